@@ -1,12 +1,20 @@
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 import httpx
+import orjson
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.staticfiles import StaticFiles
 from typing import Dict, Any, Optional
 
+from circuit_breaker import CircuitBreaker, CircuitBreakerOpen
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -14,11 +22,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create a shared HTTP client on startup and close it on shutdown"""
+    app.state.http = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30),
+        http2=True,
+        timeout=httpx.Timeout(30.0, connect=2.0),
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="API Gateway",
     description="API Gateway for SmartInventory Microservices",
     version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -30,6 +53,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses. Proxied responses that already carry a
+# Content-Encoding from upstream are passed through without recompressing.
+GZIP_MINIMUM_SIZE = 1024
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
 # Environment variables for service URLs
 PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://localhost:8001")
 INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://localhost:8002")
@@ -44,6 +72,83 @@ SERVICE_REGISTRY = {
     "notifications": NOTIFICATION_SERVICE_URL,
 }
 
+# Circuit breaker for each downstream service so failing backends are not hammered
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))
+BREAKERS = {
+    service_name: CircuitBreaker(service_name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+    for service_name in SERVICE_REGISTRY
+}
+
+# Proxy target prefix for each service, e.g. products -> http://localhost:8001/products
+TARGET_PREFIX = {
+    service_name: f"{service_url.rstrip('/')}/{service_name}"
+    for service_name, service_url in SERVICE_REGISTRY.items()
+}
+
+# Request headers forwarded to downstream services. Hop-by-hop headers such as
+# host, connection and content-length are left for httpx to set.
+FORWARD_HEADERS = frozenset({
+    "authorization",
+    "accept",
+    "accept-language",
+    "user-agent",
+    "x-request-id",
+    "x-forwarded-for",
+    "content-type",
+})
+
+# Response headers that must not be copied from the upstream response when proxying.
+# Content-Encoding is kept because the raw (still encoded) body is streamed through.
+HOP_BY_HOP_RESPONSE_HEADERS = frozenset({"transfer-encoding", "connection", "keep-alive"})
+
+# Maximum number of concurrent downstream calls per aggregation request
+MAX_FANOUT = int(os.getenv("MAX_FANOUT", "32"))
+
+# Short-lived cache of product metadata used by the aggregation endpoints.
+# Inventory is deliberately not cached since it changes on every order.
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", "60"))
+PRODUCT_CACHE = TTLCache(maxsize=10_000, ttl=PRODUCT_CACHE_TTL)
+_product_locks: Dict[int, asyncio.Lock] = {}
+
+def forwarded_headers(request: Request) -> Dict[str, str]:
+    """Build the headers to forward downstream, appending the client to X-Forwarded-For"""
+    headers = {key: value for key, value in request.headers.items() if key in FORWARD_HEADERS}
+    if request.client:
+        forwarded_for = headers.get("x-forwarded-for")
+        headers["x-forwarded-for"] = f"{forwarded_for}, {request.client.host}" if forwarded_for else request.client.host
+    return headers
+
+async def get_cached_product(
+    client: httpx.AsyncClient,
+    product_id: int,
+    headers: Optional[Dict[str, str]] = None
+) -> Optional[Dict[str, Any]]:
+    """Get product data from the cache, fetching it from the product service on a miss"""
+    product = PRODUCT_CACHE.get(product_id)
+    if product is not None:
+        return product
+    
+    # Only one request per product fills the cache; concurrent callers wait for it
+    lock = _product_locks.setdefault(product_id, asyncio.Lock())
+    try:
+        async with lock:
+            product = PRODUCT_CACHE.get(product_id)
+            if product is not None:
+                return product
+            
+            async with BREAKERS["products"]:
+                response = await client.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}", headers=headers)
+            if response.status_code != 200:
+                return None
+            
+            product = orjson.loads(response.content)
+            PRODUCT_CACHE[product_id] = product
+            return product
+    finally:
+        if not lock.locked() and _product_locks.get(product_id) is lock:
+            del _product_locks[product_id]
+
 @app.get("/", tags=["Root"])
 def read_root():
     """Root endpoint for health checks and service discovery"""
@@ -54,23 +159,28 @@ def read_root():
     }
 
 @app.get("/health", tags=["Health"])
-async def health_check():
+async def health_check(request: Request):
     """Health check endpoint that pings all services"""
     results = {}
+    client = request.app.state.http
     
-    async with httpx.AsyncClient() as client:
-        for service_name, service_url in SERVICE_REGISTRY.items():
-            try:
-                response = await client.get(f"{service_url}/", timeout=2.0)
-                results[service_name] = {
-                    "status": "up" if response.status_code == 200 else "down",
-                    "status_code": response.status_code
-                }
-            except Exception as e:
-                results[service_name] = {
-                    "status": "down",
-                    "error": str(e)
-                }
+    # Ping all services concurrently
+    responses = await asyncio.gather(
+        *(client.get(f"{service_url}/", timeout=2.0) for service_url in SERVICE_REGISTRY.values()),
+        return_exceptions=True
+    )
+    
+    for service_name, response in zip(SERVICE_REGISTRY, responses):
+        if isinstance(response, Exception):
+            results[service_name] = {
+                "status": "down",
+                "error": str(response)
+            }
+        else:
+            results[service_name] = {
+                "status": "up" if response.status_code == 200 else "down",
+                "status_code": response.status_code
+            }
     
     all_up = all(result["status"] == "up" for result in results.values())
     
@@ -79,93 +189,36 @@ async def health_check():
         "services": results
     }
 
-@app.api_route("/{service}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"], include_in_schema=True)
-async def proxy_request(service: str, path: str, request: Request):
-    """Proxy requests to the appropriate microservice"""
-    # We don't need to skip routes here, as FastAPI's router will handle the special aggregation endpoints
-    # The proxy will only be called for routes that don't match specific endpoints
-        
-    if service not in SERVICE_REGISTRY:
-        raise HTTPException(status_code=404, detail=f"Service '{service}' not found")
-    
-    service_url = SERVICE_REGISTRY[service]
-    
-    # Map service name to actual service endpoints
-    service_paths = {
-        "products": "products",
-        "inventory": "inventory",
-        "orders": "orders",
-        "notifications": "notifications"
-    }
-    
-    # Determine the correct path to forward
-    service_path = service_paths.get(service, '')
-    
-    # Construct the target URL carefully to avoid protocol issues
-    if service_url.endswith('/'):
-        service_url = service_url[:-1]
-        
-    if service_path:
-        target_url = f"{service_url}/{service_path}/{path}"
-    else:
-        target_url = f"{service_url}/{path}"
-    
-    # Get request body
-    body = None
-    if request.method in ["POST", "PUT"]:
-        body = await request.json()
-    
-    # Get request headers and query params
-    headers = dict(request.headers)
-    headers.pop("host", None)
-    
-    params = dict(request.query_params)
-    
-    # Forward the request to the appropriate service
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                json=body,
-                headers=headers,
-                params=params,
-                timeout=30.0
-            )
-            
-            return JSONResponse(
-                content=response.json(),
-                status_code=response.status_code
-            )
-    except httpx.RequestError as e:
-        logger.error(f"Error forwarding request to {target_url}: {e}")
-        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
 @app.get("/products/{product_id}/with-inventory", tags=["Aggregation"])
-async def get_product_with_inventory(product_id: int):
+async def get_product_with_inventory(product_id: int, request: Request):
     """Aggregate product and inventory information"""
     product = None
     inventory = None
+    client = request.app.state.http
+    headers = forwarded_headers(request)
     
-    async with httpx.AsyncClient() as client:
-        # Get product information
-        try:
-            product_response = await client.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
-            if product_response.status_code == 200:
-                product = product_response.json()
-        except Exception as e:
-            logger.error(f"Error fetching product data: {e}")
-        
-        # Get inventory information
-        try:
-            inventory_response = await client.get(f"{INVENTORY_SERVICE_URL}/inventory/{product_id}")
-            if inventory_response.status_code == 200:
-                inventory = inventory_response.json()
-        except Exception as e:
-            logger.error(f"Error fetching inventory data: {e}")
+    # Get product and inventory information concurrently
+    async def fetch_inventory():
+        async with BREAKERS["inventory"]:
+            return await client.get(f"{INVENTORY_SERVICE_URL}/inventory/{product_id}", headers=headers)
+    
+    product_result, inventory_response = await asyncio.gather(
+        get_cached_product(client, product_id, headers),
+        fetch_inventory(),
+        return_exceptions=True
+    )
+    
+    if isinstance(product_result, CircuitBreakerOpen):
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {product_result}")
+    elif isinstance(product_result, Exception):
+        logger.error(f"Error fetching product data: {product_result}")
+    else:
+        product = product_result
+    
+    if isinstance(inventory_response, Exception):
+        logger.error(f"Error fetching inventory data: {inventory_response}")
+    elif inventory_response.status_code == 200:
+        inventory = orjson.loads(inventory_response.content)
     
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -179,53 +232,136 @@ async def get_product_with_inventory(product_id: int):
     return result
 
 @app.get("/orders/{order_id}/with-products", tags=["Aggregation"])
-async def get_order_with_products(order_id: int):
+async def get_order_with_products(order_id: int, request: Request):
     """Aggregate order information with product details"""
-    async with httpx.AsyncClient() as client:
-        # Get order information
-        order_response = await client.get(f"{ORDER_SERVICE_URL}/orders/{order_id}")
-        if order_response.status_code != 200:
-            raise HTTPException(
-                status_code=order_response.status_code, 
-                detail="Order not found"
-            )
+    client = request.app.state.http
+    headers = forwarded_headers(request)
+    
+    # Get order information
+    try:
+        async with BREAKERS["orders"]:
+            order_response = await client.get(f"{ORDER_SERVICE_URL}/orders/{order_id}", headers=headers)
+    except CircuitBreakerOpen as e:
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {e}")
+    except httpx.RequestError as e:
+        logger.error(f"Error fetching order {order_id}: {e}")
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {e}")
+    if order_response.status_code != 200:
+        raise HTTPException(
+            status_code=order_response.status_code, 
+            detail="Order not found"
+        )
+    
+    order = orjson.loads(order_response.content)
+    
+    items = order.get("items", [])
+    
+    # Get product information for all order items concurrently
+    semaphore = asyncio.Semaphore(MAX_FANOUT)
+    
+    async def fetch_product(product_id):
+        async with semaphore:
+            return await get_cached_product(client, product_id, headers)
+    
+    products = await asyncio.gather(
+        *(fetch_product(item.get("product_id")) for item in items),
+        return_exceptions=True
+    )
+    
+    enriched_items = []
+    for item, product in zip(items, products):
+        if isinstance(product, Exception):
+            logger.error(f"Error fetching product data: {product}")
+            enriched_items.append({
+                **item,
+                "product": {"error": str(product)}
+            })
+        elif product is not None:
+            enriched_items.append({
+                **item,
+                "product": {
+                    "name": product.get("name"),
+                    "sku": product.get("sku"),
+                    "description": product.get("description")
+                }
+            })
+        else:
+            enriched_items.append({
+                **item,
+                "product": {"error": "Product not found"}
+            })
+    
+    # Return the enriched order
+    return {
+        **order,
+        "items": enriched_items
+    }
+
+@app.api_route("/{service}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"], include_in_schema=True)
+async def proxy_request(service: str, path: str, request: Request):
+    """Proxy requests to the appropriate microservice"""
+    # Aggregation endpoints are registered before this catch-all route so they match first
+    target_prefix = TARGET_PREFIX.get(service)
+    if target_prefix is None:
+        raise HTTPException(status_code=404, detail=f"Service '{service}' not found")
+    
+    target_url = f"{target_prefix}/{path}"
+    
+    # Get raw request body so non-JSON payloads are forwarded untouched
+    body = await request.body()
+    
+    # Get request headers and query params, keeping repeated query keys
+    headers = forwarded_headers(request)
+    # The raw upstream body is streamed back as-is, so only accept encodings the
+    # client accepts; otherwise httpx would ask for gzip on the client's behalf
+    headers["accept-encoding"] = request.headers.get("accept-encoding", "identity")
+    
+    params = request.query_params.multi_items()
+    
+    # Forward the request to the appropriate service and stream the response back
+    client = request.app.state.http
+    try:
+        upstream_request = client.build_request(
+            method=request.method,
+            url=target_url,
+            content=body,
+            headers=headers,
+            params=params
+        )
+        async with BREAKERS[service]:
+            response = await client.send(upstream_request, stream=True)
         
-        order = order_response.json()
+        response_headers = {
+            key: value for key, value in response.headers.items()
+            if key.lower() not in HOP_BY_HOP_RESPONSE_HEADERS
+        }
         
-        # Get product information for each order item
-        enriched_items = []
-        for item in order.get("items", []):
-            product_id = item.get("product_id")
+        # GZipMiddleware compresses every streamed response regardless of size,
+        # so buffer small bodies to let it honor the minimum size
+        content_length = response.headers.get("content-length")
+        if content_length is not None and int(content_length) < GZIP_MINIMUM_SIZE:
             try:
-                product_response = await client.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
-                if product_response.status_code == 200:
-                    product = product_response.json()
-                    enriched_items.append({
-                        **item,
-                        "product": {
-                            "name": product.get("name"),
-                            "sku": product.get("sku"),
-                            "description": product.get("description")
-                        }
-                    })
-                else:
-                    enriched_items.append({
-                        **item,
-                        "product": {"error": "Product not found"}
-                    })
-            except Exception as e:
-                logger.error(f"Error fetching product data: {e}")
-                enriched_items.append({
-                    **item,
-                    "product": {"error": str(e)}
-                })
+                content = b"".join([chunk async for chunk in response.aiter_raw()])
+            finally:
+                await response.aclose()
+            return Response(content=content, status_code=response.status_code, headers=response_headers)
         
-        # Return the enriched order
-        return {
-            **order,
-            "items": enriched_items
-        }
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers=response_headers,
+            background=BackgroundTask(response.aclose)
+        )
+    except CircuitBreakerOpen as e:
+        logger.warning(f"Rejected request to {target_url}: {e}")
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    except httpx.RequestError as e:
+        logger.error(f"Error forwarding request to {target_url}: {e}")
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools")
@@ -0,0 +1,55 @@
+import time
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreakerOpen(Exception):
+    """Raised when a call is rejected because the circuit is open"""
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker for '{name}' is open")
+        self.name = name
+
+class CircuitBreaker:
+    """Per-service circuit breaker
+
+    Opens after `failure_threshold` consecutive transport failures and rejects
+    calls until `reset_timeout` seconds have passed. A single trial call is then
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+
+    async def __aenter__(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitBreakerOpen(self.name)
+            self.state = "half_open"
+        elif self.state == "half_open":
+            # A trial call is already in flight
+            raise CircuitBreakerOpen(self.name)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            if self.state != "closed":
+                logger.info(f"Circuit breaker for '{self.name}' closed")
+            self.state = "closed"
+            self.failures = 0
+        elif issubclass(exc_type, httpx.RequestError):
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit breaker for '{self.name}' opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+        elif self.state == "half_open":
+            # The trial call failed for an unrelated reason; allow another trial
+            self.state = "open"
+        return False
@@ -1,20 +1,34 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 
 # Get database URL from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./inventory.db")
 
-# Create SQLAlchemy engine and session
+# Create SQLAlchemy engines. The sync engine is only used for schema creation
+# and migrations; request handlers go through the async engine.
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
         DATABASE_URL, connect_args={"check_same_thread": False}
     )
+    ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="sqlite+aiosqlite")
 else:
     engine = create_engine(DATABASE_URL)
+    ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+# Dialect-specific INSERT construct supporting ON CONFLICT upserts
+if engine.dialect.name == "postgresql":
+    from sqlalchemy.dialects.postgresql import insert
+else:
+    from sqlalchemy.dialects.sqlite import insert
+
+# Keep loaded attributes after commit so rows returned by RETURNING statements
+# can be serialized without a follow-up SELECT
+SessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for SQLAlchemy models
 Base = declarative_base()
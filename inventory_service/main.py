@@ -2,11 +2,14 @@ import os
 import logging
 import httpx
 from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, Depends, HTTPException, Response, status, BackgroundTasks
+from sqlalchemy import exists, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
 from fastapi.middleware.cors import CORSMiddleware
 
 import models, schemas, database
+from circuit_breaker import CircuitBreaker, CircuitBreakerOpen
 
 # Configure logging
 logging.basicConfig(
@@ -38,23 +41,30 @@ models.Base.metadata.create_all(bind=database.engine)
 PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://localhost:8001")
 NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://localhost:8004")
 STOCK_THRESHOLD = int(os.getenv("STOCK_THRESHOLD", "10"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "10"))
+
+# Circuit breakers for downstream services
+product_breaker = CircuitBreaker("products", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+notification_breaker = CircuitBreaker("notifications", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
 
 # Dependency to get database session
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 async def verify_product_exists(product_id: int) -> bool:
     """Verify that a product exists in the product service"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
+        async with product_breaker, httpx.AsyncClient() as client:
+            # HEAD lets the product service answer without serializing the product
+            response = await client.head(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
             if response.status_code == 200:
                 return True
             return False
+    except CircuitBreakerOpen as e:
+        logger.warning(f"Product service unavailable: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Product service unavailable")
     except Exception as e:
         logger.error(f"Error communicating with product service: {e}")
         return False
@@ -62,7 +72,7 @@ async def verify_product_exists(product_id: int) -> bool:
 async def notify_low_stock(inventory_item: models.InventoryItem):
     """Notify about low stock levels"""
     try:
-        async with httpx.AsyncClient() as client:
+        async with notification_breaker, httpx.AsyncClient() as client:
             payload = {
                 "type": "low_stock",
                 "product_id": inventory_item.product_id,
@@ -73,6 +83,10 @@ async def notify_low_stock(inventory_item: models.InventoryItem):
     except Exception as e:
         logger.error(f"Failed to send low stock notification: {e}")
 
+def crossed_low_stock_threshold(prev_quantity: float, new_quantity: float) -> bool:
+    """Check whether a quantity change moved stock from above the threshold to at or below it"""
+    return prev_quantity > STOCK_THRESHOLD >= new_quantity
+
 @app.get("/", tags=["Root"])
 def read_root():
     """Root endpoint for health checks"""
@@ -82,7 +96,7 @@ def read_root():
 async def create_inventory_item(
     item: schemas.InventoryItemCreate, 
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new inventory item or update if already exists"""
     logger.info(f"Creating/updating inventory for product ID: {item.product_id}")
@@ -93,47 +107,67 @@ async def create_inventory_item(
         logger.warning(f"Product with ID {item.product_id} not found in product service")
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Check if inventory item already exists
-    db_item = db.query(models.InventoryItem).filter(
-        models.InventoryItem.product_id == item.product_id
-    ).first()
-    
-    if db_item:
-        # Update existing item
-        db_item.quantity = item.quantity
-        db_item.location = item.location
-    else:
-        # Create new item
-        db_item = models.InventoryItem(
-            product_id=item.product_id,
-            quantity=item.quantity,
-            location=item.location
-        )
-        db.add(db_item)
+    # Lock the existing row, if any, and remember its quantity; a new item counts as
+    # coming from above the threshold
+    prev_quantity = await db.scalar(
+        select(models.InventoryItem.quantity)
+        .where(models.InventoryItem.product_id == item.product_id)
+        .with_for_update()
+    )
+    if prev_quantity is None:
+        prev_quantity = float("inf")
+    
+    # Insert the inventory item, or update it if one already exists for the product
+    stmt = database.insert(models.InventoryItem).values(
+        product_id=item.product_id,
+        quantity=item.quantity,
+        location=item.location
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.InventoryItem.product_id],
+        set_={
+            "quantity": stmt.excluded.quantity,
+            "location": stmt.excluded.location,
+            "last_updated": func.now()
+        }
+    ).returning(models.InventoryItem)
     
-    db.commit()
-    db.refresh(db_item)
+    db_item = (await db.scalars(stmt)).one()
+    await db.commit()
     
-    # Check for low stock
-    if db_item.quantity <= STOCK_THRESHOLD:
+    # Notify only when stock drops to or below the threshold
+    if crossed_low_stock_threshold(prev_quantity, db_item.quantity):
         background_tasks.add_task(notify_low_stock, db_item)
     
     return db_item
 
 @app.get("/inventory/", response_model=List[schemas.InventoryItem], tags=["Inventory"])
-def read_inventory_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all inventory items with pagination"""
-    logger.info(f"Fetching inventory items with skip={skip}, limit={limit}")
-    items = db.query(models.InventoryItem).offset(skip).limit(limit).all()
-    return items
+async def read_inventory_items(after_id: Optional[int] = None, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    """Get inventory items with keyset pagination"""
+    logger.info(f"Fetching inventory items with after_id={after_id}, limit={limit}")
+    query = select(models.InventoryItem)
+    
+    # Seek past the last seen ID instead of scanning and discarding rows with OFFSET
+    if after_id is not None:
+        query = query.where(models.InventoryItem.id > after_id)
+    
+    items = (await db.scalars(query.order_by(models.InventoryItem.id).limit(limit))).all()
+    
+    # Serialize the whole page at once instead of validating each row separately
+    return Response(
+        content=schemas.InventoryItemList.dump_json(
+            schemas.InventoryItemList.validate_python(items, from_attributes=True)
+        ),
+        media_type="application/json"
+    )
 
 @app.get("/inventory/{product_id}", response_model=schemas.InventoryItem, tags=["Inventory"])
-def read_inventory_item(product_id: int, db: Session = Depends(get_db)):
+async def read_inventory_item(product_id: int, db: AsyncSession = Depends(get_db)):
     """Get inventory item by product ID"""
     logger.info(f"Fetching inventory for product ID: {product_id}")
-    item = db.query(models.InventoryItem).filter(
-        models.InventoryItem.product_id == product_id
-    ).first()
+    item = await db.scalar(
+        select(models.InventoryItem).where(models.InventoryItem.product_id == product_id)
+    )
     if item is None:
         logger.warning(f"Inventory for product ID {product_id} not found")
         raise HTTPException(status_code=404, detail="Inventory item not found")
@@ -144,7 +178,7 @@ async def update_inventory_item(
     product_id: int, 
     item: schemas.InventoryItemUpdate, 
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update an inventory item"""
     logger.info(f"Updating inventory for product ID: {product_id}")
@@ -155,23 +189,34 @@ async def update_inventory_item(
         logger.warning(f"Product with ID {product_id} not found in product service")
         raise HTTPException(status_code=404, detail="Product not found")
     
-    db_item = db.query(models.InventoryItem).filter(
-        models.InventoryItem.product_id == product_id
-    ).first()
+    values = item.model_dump(exclude_unset=True)
+    
+    # Lock the row and remember its quantity when the quantity is changing
+    prev_quantity = None
+    if "quantity" in values:
+        prev_quantity = await db.scalar(
+            select(models.InventoryItem.quantity)
+            .where(models.InventoryItem.product_id == product_id)
+            .with_for_update()
+        )
+    
+    # Update inventory attributes and return the updated row in one statement
+    stmt = (
+        update(models.InventoryItem)
+        .where(models.InventoryItem.product_id == product_id)
+        .values(**values, last_updated=func.now())
+        .returning(models.InventoryItem)
+    )
+    db_item = (await db.scalars(stmt)).first()
     
     if db_item is None:
         logger.warning(f"Inventory for product ID {product_id} not found")
         raise HTTPException(status_code=404, detail="Inventory item not found")
     
-    # Update inventory attributes
-    for key, value in item.dict(exclude_unset=True).items():
-        setattr(db_item, key, value)
-    
-    db.commit()
-    db.refresh(db_item)
+    await db.commit()
     
-    # Check for low stock
-    if db_item.quantity <= STOCK_THRESHOLD:
+    # Notify only when stock drops to or below the threshold
+    if prev_quantity is not None and crossed_low_stock_threshold(prev_quantity, db_item.quantity):
         background_tasks.add_task(notify_low_stock, db_item)
     
     return db_item
@@ -181,38 +226,49 @@ async def adjust_inventory(
     product_id: int, 
     adjustment: schemas.InventoryAdjustment, 
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Adjust inventory quantity (add or subtract)"""
     logger.info(f"Adjusting inventory for product ID: {product_id}, amount: {adjustment.amount}")
     
-    db_item = db.query(models.InventoryItem).filter(
-        models.InventoryItem.product_id == product_id
-    ).first()
-    
-    if db_item is None:
-        logger.warning(f"Inventory for product ID {product_id} not found")
-        raise HTTPException(status_code=404, detail="Inventory item not found")
+    # Apply the adjustment atomically so concurrent adjustments cannot lose updates
+    stmt = (
+        update(models.InventoryItem)
+        .where(models.InventoryItem.product_id == product_id)
+        .values(quantity=models.InventoryItem.quantity + adjustment.amount, last_updated=func.now())
+        .returning(models.InventoryItem)
+    )
     
     # Prevent negative inventory unless allowed
-    new_quantity = db_item.quantity + adjustment.amount
-    if new_quantity < 0 and not adjustment.allow_negative:
+    if not adjustment.allow_negative:
+        stmt = stmt.where(models.InventoryItem.quantity + adjustment.amount >= 0)
+    
+    db_item = (await db.scalars(stmt)).first()
+    
+    if db_item is None:
+        # No row was updated: either the item is missing or the adjustment was rejected
+        item_exists = await db.scalar(
+            select(exists().where(models.InventoryItem.product_id == product_id))
+        )
+        if not item_exists:
+            logger.warning(f"Inventory for product ID {product_id} not found")
+            raise HTTPException(status_code=404, detail="Inventory item not found")
+        
         logger.warning(f"Adjustment would cause negative inventory for product ID {product_id}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Adjustment would cause negative inventory"
         )
     
-    db_item.quantity = new_quantity
-    db.commit()
-    db.refresh(db_item)
+    await db.commit()
     
-    # Check for low stock
-    if db_item.quantity <= STOCK_THRESHOLD:
+    # Notify only when stock drops to or below the threshold; the previous
+    # quantity follows from the atomic update
+    if crossed_low_stock_threshold(db_item.quantity - adjustment.amount, db_item.quantity):
         background_tasks.add_task(notify_low_stock, db_item)
     
     return db_item
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools")
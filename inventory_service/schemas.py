@@ -1,6 +1,6 @@
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 
 class InventoryItemBase(BaseModel):
     """Base schema for inventory items"""
@@ -38,3 +38,6 @@ class InventoryItem(InventoryItemBase):
 
     class Config:
         from_attributes = True
+
+# Validates and serializes a whole list of inventory items in one call
+InventoryItemList = TypeAdapter(List[InventoryItem])
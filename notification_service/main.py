@@ -1,8 +1,16 @@
 import os
+import asyncio
 import logging
-from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+import socket
+import orjson
+import redis.asyncio as redis
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+from typing import Dict, List, Optional, Union
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 
@@ -15,11 +23,48 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Notification dispatch batching
+BATCH_MAX = int(os.getenv("NOTIFICATION_BATCH_MAX", "100"))
+BATCH_MS = int(os.getenv("NOTIFICATION_BATCH_MS", "50"))
+
+# Notification stream that other services publish to
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+NOTIFICATION_STREAM = os.getenv("NOTIFICATION_STREAM", "notifications")
+CONSUMER_GROUP = os.getenv("NOTIFICATION_CONSUMER_GROUP", "notification-service")
+CONSUMER_NAME = os.getenv("NOTIFICATION_CONSUMER_NAME", socket.gethostname())
+STREAM_RETRY_SECONDS = float(os.getenv("NOTIFICATION_STREAM_RETRY_SECONDS", "5"))
+STREAM_BLOCK_MS = 5000
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the notification dispatch and stream workers on startup and stop them on shutdown"""
+    app.state.notification_queue = asyncio.Queue()
+    # Time out a stalled Redis instead of hanging, while outlasting blocking stream reads
+    app.state.redis = redis.Redis.from_url(
+        REDIS_URL, socket_connect_timeout=1, socket_timeout=STREAM_BLOCK_MS / 1000 + 5
+    )
+    # Requeue notifications that were stored but not dispatched before the last shutdown
+    await queue_pending_notifications(app.state.notification_queue)
+    workers = [
+        asyncio.create_task(notification_worker(app.state.notification_queue)),
+        asyncio.create_task(notification_stream_consumer(app.state.redis, app.state.notification_queue)),
+    ]
+    try:
+        yield
+    finally:
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            with suppress(asyncio.CancelledError):
+                await worker
+        await app.state.redis.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Notification Service",
     description="Manages notifications for SmartInventory system",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -35,18 +80,16 @@ app.add_middleware(
 models.Base.metadata.create_all(bind=database.engine)
 
 # Dependency to get database session
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-async def send_email_notification(recipient: str, subject: str, message: str):
-    """Send email notification (mock implementation)"""
-    logger.info(f"[EMAIL] To: {recipient}, Subject: {subject}, Message: {message}")
-    # In a real implementation, this would connect to an email service
-    # like SendGrid, Mailgun, SES, etc.
+async def send_bulk_email(emails: List[Dict[str, str]]):
+    """Send a batch of email notifications (mock implementation)"""
+    for email in emails:
+        logger.info(f"[EMAIL] To: {email['recipient']}, Subject: {email['subject']}, Message: {email['message']}")
+    # In a real implementation, this would make a single call to the bulk
+    # endpoint of an email service like SendGrid, Mailgun, SES, etc.
     return True
 
 async def send_sms_notification(phone_number: str, message: str):
@@ -56,59 +99,178 @@ async def send_sms_notification(phone_number: str, message: str):
     # like Twilio, Nexmo, etc.
     return True
 
-async def process_notification(notification_id: int, db: Session):
-    """Process a notification in the background"""
-    logger.info(f"Processing notification {notification_id}")
+def build_email(notification: models.Notification) -> Optional[Dict[str, str]]:
+    """Build the email for a notification, or None if there is nothing to send"""
+    if notification.type == "low_stock":
+        # Low stock alert
+        return {
+            "recipient": "inventory_manager@example.com",  # This would be configurable
+            "subject": "Low Stock Alert",
+            "message": f"Product ID {notification.data.get('product_id')} is running low. "
+                       f"Current quantity: {notification.data.get('current_quantity')}, "
+                       f"Threshold: {notification.data.get('threshold')}"
+        }
     
-    # Get the notification
-    notification = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
-    if not notification:
-        logger.error(f"Notification {notification_id} not found")
-        return
+    if notification.type == "order_status":
+        # Order status update
+        order_id = notification.data.get('order_id')
+        recipient = notification.data.get('recipient')
+        if recipient:
+            return {
+                "recipient": recipient,
+                "subject": f"Order #{order_id} Status Update",
+                "message": f"Your order #{order_id} has been {notification.data.get('status')}."
+            }
     
-    try:
-        # Handle different notification types
-        if notification.type == "low_stock":
-            # Send low stock alert
-            subject = "Low Stock Alert"
-            message = f"Product ID {notification.data.get('product_id')} is running low. " \
-                      f"Current quantity: {notification.data.get('current_quantity')}, " \
-                      f"Threshold: {notification.data.get('threshold')}"
-            
-            await send_email_notification(
-                recipient="inventory_manager@example.com",  # This would be configurable
-                subject=subject,
-                message=message
-            )
-            
-        elif notification.type == "order_status":
-            # Send order status update
-            order_id = notification.data.get('order_id')
-            status = notification.data.get('status')
-            recipient = notification.data.get('recipient')
-            
-            subject = f"Order #{order_id} Status Update"
-            message = f"Your order #{order_id} has been {status}."
-            
-            if recipient:
-                await send_email_notification(
-                    recipient=recipient,
-                    subject=subject,
-                    message=message
+    return None
+
+async def process_notifications(notification_ids: List[int]):
+    """Process a batch of notifications"""
+    logger.info(f"Processing {len(notification_ids)} notifications")
+    
+    # Use a dedicated session since the request-scoped one is closed once the response is sent
+    async with database.SessionLocal() as db:
+        notifications = (await db.scalars(
+            select(models.Notification).where(models.Notification.id.in_(notification_ids))
+        )).all()
+        
+        missing = set(notification_ids) - {notification.id for notification in notifications}
+        if missing:
+            logger.error(f"Notifications {sorted(missing)} not found")
+        
+        # Group notifications by type so each group is dispatched with one bulk call
+        groups: Dict[str, List[models.Notification]] = defaultdict(list)
+        for notification in notifications:
+            groups[notification.type].append(notification)
+        
+        for notification_type, group in groups.items():
+            ids = [notification.id for notification in group]
+            try:
+                emails = [email for email in map(build_email, group) if email is not None]
+                if emails:
+                    await send_bulk_email(emails)
+                
+                # Mark notifications as sent
+                await db.execute(
+                    update(models.Notification)
+                    .where(models.Notification.id.in_(ids))
+                    .values(status="sent", sent_at=datetime.now())
                 )
+                logger.info(f"{len(ids)} {notification_type} notifications processed successfully")
+                
+            except Exception as e:
+                # Mark notifications as failed
+                await db.execute(
+                    update(models.Notification)
+                    .where(models.Notification.id.in_(ids))
+                    .values(status="failed", error_message=str(e))
+                )
+                logger.error(f"Failed to process {notification_type} notifications {ids}: {e}")
         
-        # Mark notification as sent
-        notification.status = "sent"
-        notification.sent_at = datetime.now()
-        db.commit()
-        logger.info(f"Notification {notification_id} processed successfully")
+        await db.commit()
+
+async def queue_pending_notifications(queue: asyncio.Queue):
+    """Put every notification still pending in the database on the dispatch queue"""
+    async with database.SessionLocal() as db:
+        pending_ids = (await db.scalars(
+            select(models.Notification.id)
+            .where(models.Notification.status == "pending")
+            .order_by(models.Notification.id)
+        )).all()
+    
+    for notification_id in pending_ids:
+        queue.put_nowait(notification_id)
+    if pending_ids:
+        logger.info(f"Queued {len(pending_ids)} pending notifications for dispatch")
+
+async def notification_worker(queue: asyncio.Queue):
+    """Drain queued notification IDs in batches of up to BATCH_MAX or every BATCH_MS"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + BATCH_MS / 1000
+        
+        while len(batch) < BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
         
-    except Exception as e:
-        # Mark notification as failed
-        notification.status = "failed"
-        notification.error_message = str(e)
-        db.commit()
-        logger.error(f"Failed to process notification {notification_id}: {e}")
+        try:
+            await process_notifications(batch)
+        except Exception as e:
+            logger.error(f"Failed to process notification batch {batch}: {e}")
+
+async def store_stream_notifications(messages: list) -> List[int]:
+    """Store notifications read from the notification stream and return their IDs"""
+    rows = []
+    for message_id, fields in messages:
+        # Entries trimmed from the stream come back without fields
+        if fields is None:
+            continue
+        try:
+            rows.append({
+                "type": fields[b"type"].decode(),
+                "data": orjson.loads(fields[b"data"]),
+                "status": "pending"
+            })
+        except (KeyError, ValueError) as e:
+            logger.error(f"Skipping malformed notification message {message_id}: {e}")
+    
+    if not rows:
+        return []
+    
+    async with database.SessionLocal() as db:
+        ids = (await db.scalars(
+            insert(models.Notification).returning(models.Notification.id), rows
+        )).all()
+        await db.commit()
+    return list(ids)
+
+async def handle_stream_messages(client: redis.Redis, queue: asyncio.Queue, messages: list):
+    """Store a batch of stream messages, queue them for dispatch and acknowledge them"""
+    for notification_id in await store_stream_notifications(messages):
+        queue.put_nowait(notification_id)
+    await client.xack(
+        NOTIFICATION_STREAM, CONSUMER_GROUP, *(message_id for message_id, _ in messages)
+    )
+
+async def notification_stream_consumer(client: redis.Redis, queue: asyncio.Queue):
+    """Drain the notification stream, storing each batch and queueing it for dispatch"""
+    while True:
+        try:
+            try:
+                await client.xgroup_create(NOTIFICATION_STREAM, CONSUMER_GROUP, id="0", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            
+            # Store entries read before a failure or restart but never acknowledged
+            last_id = "0"
+            while True:
+                entries = await client.xreadgroup(
+                    CONSUMER_GROUP, CONSUMER_NAME, {NOTIFICATION_STREAM: last_id}, count=BATCH_MAX
+                )
+                messages = entries[0][1] if entries else []
+                if not messages:
+                    break
+                await handle_stream_messages(client, queue, messages)
+                last_id = messages[-1][0]
+            
+            while True:
+                entries = await client.xreadgroup(
+                    CONSUMER_GROUP, CONSUMER_NAME, {NOTIFICATION_STREAM: ">"}, count=BATCH_MAX, block=STREAM_BLOCK_MS
+                )
+                for _, messages in entries:
+                    await handle_stream_messages(client, queue, messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Notification stream consumer failed, retrying in {STREAM_RETRY_SECONDS}s: {e}")
+            await asyncio.sleep(STREAM_RETRY_SECONDS)
 
 @app.get("/", tags=["Root"])
 def read_root():
@@ -118,8 +280,8 @@ def read_root():
 @app.post("/notifications/", response_model=schemas.Notification, status_code=status.HTTP_201_CREATED, tags=["Notifications"])
 async def create_notification(
     notification: schemas.NotificationCreate, 
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new notification"""
     logger.info(f"Creating notification of type: {notification.type}")
@@ -131,37 +293,62 @@ async def create_notification(
         status="pending"
     )
     db.add(db_notification)
-    db.commit()
-    db.refresh(db_notification)
+    await db.commit()
+    await db.refresh(db_notification)
     
-    # Process notification in background
-    background_tasks.add_task(process_notification, db_notification.id, db)
+    # Queue notification for batched dispatch
+    request.app.state.notification_queue.put_nowait(db_notification.id)
     
     return db_notification
 
-@app.get("/notifications/", response_model=List[schemas.Notification], tags=["Notifications"])
-def read_notifications(
-    skip: int = 0, 
+@app.get("/notifications/", response_model=List[Union[schemas.NotificationSummary, schemas.Notification]], tags=["Notifications"])
+async def read_notifications(
+    after_id: Optional[int] = None, 
     limit: int = 100, 
     status: Optional[str] = None,
-    db: Session = Depends(get_db)
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_db)
 ):
-    """Get all notifications with optional filtering by status"""
-    logger.info(f"Fetching notifications with status={status}")
+    """Get notification summaries with keyset pagination and optional filtering by status
+
+    Pass fields=data to include the full notification, data payload included.
+    """
+    logger.info(f"Fetching notifications with status={status}, after_id={after_id}")
+    
+    include_data = fields is not None and "data" in fields.split(",")
     
-    query = db.query(models.Notification)
+    query = select(models.Notification)
+    
+    # Only load the columns needed for a summary unless the payload was asked for
+    if not include_data:
+        query = query.options(load_only(
+            models.Notification.id,
+            models.Notification.type,
+            models.Notification.status,
+            models.Notification.created_at
+        ))
     
     if status:
-        query = query.filter(models.Notification.status == status)
+        query = query.where(models.Notification.status == status)
+    
+    # Seek past the last seen ID instead of scanning and discarding rows with OFFSET
+    if after_id is not None:
+        query = query.where(models.Notification.id > after_id)
     
-    notifications = query.offset(skip).limit(limit).all()
-    return notifications
+    notifications = (await db.scalars(query.order_by(models.Notification.id).limit(limit))).all()
+    
+    # Serialize the whole page at once instead of validating each row separately
+    adapter = schemas.NotificationList if include_data else schemas.NotificationSummaryList
+    return Response(
+        content=adapter.dump_json(adapter.validate_python(notifications, from_attributes=True)),
+        media_type="application/json"
+    )
 
 @app.get("/notifications/{notification_id}", response_model=schemas.Notification, tags=["Notifications"])
-def read_notification(notification_id: int, db: Session = Depends(get_db)):
+async def read_notification(notification_id: int, db: AsyncSession = Depends(get_db)):
     """Get notification by ID"""
     logger.info(f"Fetching notification with ID: {notification_id}")
-    notification = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
+    notification = await db.get(models.Notification, notification_id)
     if notification is None:
         logger.warning(f"Notification with ID {notification_id} not found")
         raise HTTPException(status_code=404, detail="Notification not found")
@@ -170,13 +357,13 @@ def read_notification(notification_id: int, db: Session = Depends(get_db)):
 @app.post("/notifications/{notification_id}/resend", response_model=schemas.Notification, tags=["Notifications"])
 async def resend_notification(
     notification_id: int, 
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_db)
 ):
     """Resend a failed notification"""
     logger.info(f"Resending notification with ID: {notification_id}")
     
-    notification = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
+    notification = await db.get(models.Notification, notification_id)
     if notification is None:
         logger.warning(f"Notification with ID {notification_id} not found")
         raise HTTPException(status_code=404, detail="Notification not found")
@@ -185,14 +372,14 @@ async def resend_notification(
     notification.status = "pending"
     notification.error_message = None
     notification.sent_at = None
-    db.commit()
-    db.refresh(notification)
+    await db.commit()
+    await db.refresh(notification)
     
-    # Process notification in background
-    background_tasks.add_task(process_notification, notification.id, db)
+    # Queue notification for batched dispatch
+    request.app.state.notification_queue.put_nowait(notification.id)
     
     return notification
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools")
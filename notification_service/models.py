@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Index
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -13,3 +13,8 @@ class Notification(Base):
     error_message = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Supports status-filtered keyset pagination ordered by ID
+    __table_args__ = (
+        Index("ix_notifications_status_id", "status", "id"),
+    )
@@ -1,6 +1,6 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 
 class NotificationBase(BaseModel):
     """Base schema for notifications"""
@@ -19,5 +19,17 @@ class Notification(NotificationBase):
     created_at: datetime
     sent_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class NotificationSummary(BaseModel):
+    """Schema for listing notifications without their data payload"""
+    id: int
+    type: str
+    status: str
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+# Validate and serialize a whole list of notifications in one call
+NotificationList = TypeAdapter(List[Notification])
+NotificationSummaryList = TypeAdapter(List[NotificationSummary])
@@ -1,20 +1,40 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 
 # Get database URL from environment variables
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./order.db")
 
-# Create SQLAlchemy engine and session
+# Connection pool settings for the async engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Create SQLAlchemy engines. The sync engine is only used for schema creation
+# and migrations; request handlers and the order worker go through the async engine.
 if DATABASE_URL.startswith("sqlite"):
     engine = create_engine(
         DATABASE_URL, connect_args={"check_same_thread": False}
     )
+    ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="sqlite+aiosqlite")
+    async_engine = create_async_engine(ASYNC_DATABASE_URL)
 else:
     engine = create_engine(DATABASE_URL)
+    ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+    # Keep warm connections around instead of reconnecting on every request
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Keep loaded attributes after commit so orders can be serialized without
+# lazy loads, which are not available on async sessions
+SessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for SQLAlchemy models
 Base = declarative_base()
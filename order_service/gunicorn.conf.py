@@ -0,0 +1,15 @@
+import os
+import multiprocessing
+
+# Gunicorn settings for running the order service across all cores
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+
+def on_starting(server):
+    """Create database tables once in the master before workers are forked"""
+    import database, models
+
+    models.Base.metadata.create_all(bind=database.engine)
+    # Don't hand pooled connections from the master down to the workers
+    database.engine.dispose()
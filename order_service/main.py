@@ -1,9 +1,17 @@
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 import httpx
+import orjson
+import redis.asyncio as redis
 from typing import List, Optional
 from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 
@@ -16,11 +24,53 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Environment variables
+PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://localhost:8001")
+INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://localhost:8002")
+NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://localhost:8004")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", "300"))
+ORDER_STREAM = os.getenv("ORDER_STREAM", "orders.new")
+NOTIFICATION_STREAM = os.getenv("NOTIFICATION_STREAM", "notifications")
+# Approximate caps on stream length so acknowledged entries don't pile up in Redis
+ORDER_STREAM_MAXLEN = int(os.getenv("ORDER_STREAM_MAXLEN", "100000"))
+NOTIFICATION_STREAM_MAXLEN = int(os.getenv("NOTIFICATION_STREAM_MAXLEN", "100000"))
+
+# Request bodies are pre-serialized with orjson
+JSON_HEADERS = {"content-type": "application/json"}
+
+def create_service_client(base_url: str) -> httpx.AsyncClient:
+    """Create a pooled HTTP/2 client for a downstream service"""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=httpx.Timeout(10.0, connect=2.0),
+        http2=True,
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared downstream HTTP and Redis clients on startup and close them on shutdown"""
+    app.state.product_client = create_service_client(PRODUCT_SERVICE_URL)
+    app.state.inventory_client = create_service_client(INVENTORY_SERVICE_URL)
+    app.state.notification_client = create_service_client(NOTIFICATION_SERVICE_URL)
+    # Fail fast when Redis is unreachable or stalls so it never holds up a request
+    app.state.redis = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=1, socket_timeout=1)
+    try:
+        yield
+    finally:
+        await app.state.product_client.aclose()
+        await app.state.inventory_client.aclose()
+        await app.state.notification_client.aclose()
+        await app.state.redis.aclose()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Order Service",
     description="Manages customer orders for SmartInventory system",
     version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -32,129 +82,172 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create database tables
-models.Base.metadata.create_all(bind=database.engine)
-
-# Environment variables
-PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://localhost:8001")
-INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://localhost:8002")
-NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://localhost:8004")
+# Database tables are created by the process entry points (gunicorn's on_starting
+# hook, __main__ below and worker.py) rather than on import, so that gunicorn
+# workers don't all race to create them
 
 # Dependency to get database session
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-async def get_product_info(product_id: int):
-    """Get product information from product service"""
+async def get_products_bulk(product_ids: List[int]) -> dict:
+    """Get products by ID from the Redis cache, fetching any misses from the product service in one request"""
+    product_ids = list(dict.fromkeys(product_ids))
+    products = {}
+    try:
+        cached = await app.state.redis.mget([f"product:{product_id}" for product_id in product_ids])
+        for product_id, value in zip(product_ids, cached):
+            if value is not None:
+                products[product_id] = orjson.loads(value)
+    except redis.RedisError as e:
+        logger.warning("Error reading products from cache: %s", e)
+    
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if not missing:
+        return products
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
-            if response.status_code == 200:
-                return response.json()
-            else:
-                logger.error(f"Error getting product {product_id}: Status {response.status_code}")
-                return None
+        response = await app.state.product_client.get(
+            "/products/", params={"ids": ",".join(map(str, missing))}
+        )
+        if response.status_code != 200:
+            logger.error("Error getting products %s: Status %s", missing, response.status_code)
+            return products
+        fetched = orjson.loads(response.content)
     except Exception as e:
-        logger.error(f"Error communicating with product service: {e}")
-        return None
+        logger.error("Error communicating with product service: %s", e)
+        return products
+    
+    try:
+        pipe = app.state.redis.pipeline(transaction=False)
+        for product in fetched:
+            pipe.set(f"product:{product['id']}", orjson.dumps(product), ex=PRODUCT_CACHE_TTL)
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Error caching products: %s", e)
+    
+    products.update((product["id"], product) for product in fetched)
+    return products
 
 async def check_inventory(product_id: int, quantity: float):
     """Check if there's enough inventory for a product"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{INVENTORY_SERVICE_URL}/inventory/{product_id}")
-            if response.status_code == 200:
-                inventory = response.json()
-                return inventory["quantity"] >= quantity
-            else:
-                logger.error(f"Error checking inventory for product {product_id}: Status {response.status_code}")
-                return False
+        response = await app.state.inventory_client.get(f"/inventory/{product_id}")
+        if response.status_code == 200:
+            inventory = orjson.loads(response.content)
+            return inventory["quantity"] >= quantity
+        else:
+            logger.error("Error checking inventory for product %s: Status %s", product_id, response.status_code)
+            return False
     except Exception as e:
-        logger.error(f"Error communicating with inventory service: {e}")
+        logger.error("Error communicating with inventory service: %s", e)
         return False
 
 async def update_inventory(product_id: int, quantity: float):
     """Update inventory after an order is placed"""
     try:
-        async with httpx.AsyncClient() as client:
-            adjustment = {
-                "amount": -quantity,  # Negative amount to reduce inventory
-                "allow_negative": False
-            }
-            response = await client.post(
-                f"{INVENTORY_SERVICE_URL}/inventory/{product_id}/adjust", 
-                json=adjustment
-            )
-            if response.status_code == 200:
-                return True
-            else:
-                logger.error(f"Error updating inventory for product {product_id}: Status {response.status_code}")
-                return False
+        adjustment = {
+            "amount": -quantity,  # Negative amount to reduce inventory
+            "allow_negative": False
+        }
+        response = await app.state.inventory_client.post(
+            f"/inventory/{product_id}/adjust",
+            content=orjson.dumps(adjustment),
+            headers=JSON_HEADERS
+        )
+        if response.status_code == 200:
+            return True
+        else:
+            logger.error("Error updating inventory for product %s: Status %s", product_id, response.status_code)
+            return False
     except Exception as e:
-        logger.error(f"Error communicating with inventory service: {e}")
+        logger.error("Error communicating with inventory service: %s", e)
         return False
 
 async def notify_order_status(order_id: int, status: str, customer_email: str):
-    """Send notification about order status"""
+    """Publish a notification about order status to the notification stream"""
+    notification = {
+        "type": "order_status",
+        "data": {
+            "order_id": order_id,
+            "status": status,
+            "recipient": customer_email
+        }
+    }
     try:
-        async with httpx.AsyncClient() as client:
-            payload = {
-                "type": "order_status",
-                "order_id": order_id,
-                "status": status,
-                "recipient": customer_email
-            }
-            await client.post(f"{NOTIFICATION_SERVICE_URL}/notifications/", json=payload)
-    except Exception as e:
-        logger.error(f"Failed to send order notification: {e}")
-
-async def process_order(order_id: int, db: Session):
-    """Process an order in the background"""
-    logger.info(f"Processing order {order_id}")
-    
-    # Get the order
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
-    if not order:
-        logger.error(f"Order {order_id} not found")
+        await app.state.redis.xadd(
+            NOTIFICATION_STREAM,
+            {"type": notification["type"], "data": orjson.dumps(notification["data"])},
+            maxlen=NOTIFICATION_STREAM_MAXLEN,
+            approximate=True
+        )
         return
+    except redis.RedisError as e:
+        logger.error("Failed to publish order notification, posting it instead: %s", e)
     
-    # Get order items
-    order_items = db.query(models.OrderItem).filter(models.OrderItem.order_id == order_id).all()
-    
-    # Check inventory for all items
-    inventory_available = True
-    for item in order_items:
-        if not await check_inventory(item.product_id, item.quantity):
-            inventory_available = False
-            break
+    try:
+        await app.state.notification_client.post(
+            "/notifications/", content=orjson.dumps(notification), headers=JSON_HEADERS
+        )
+    except Exception as e:
+        logger.error("Failed to send order notification: %s", e)
+
+async def process_order(order_id: int):
+    """Process an order; run by the order worker"""
+    logger.info("Processing order %s", order_id)
     
-    if not inventory_available:
-        # Update order status to failed
-        order.status = "failed"
+    # Use a dedicated session since this runs outside of any request
+    async with database.SessionLocal() as db:
+        # Claim the order before touching inventory. The same order can reach several
+        # callers (stream redelivery, claimed entries, the in-process fallback), and
+        # only the one that moves it out of pending may adjust inventory.
+        order = await db.scalar(
+            update(models.Order)
+            .where(models.Order.id == order_id, models.Order.status == "pending")
+            .values(status="processing", updated_at=datetime.now())
+            .returning(models.Order)
+        )
+        await db.commit()
+        if order is None:
+            logger.info("Order %s not found or already claimed, skipping", order_id)
+            return
+        
+        # Get order items
+        order_items = (
+            await db.scalars(select(models.OrderItem).where(models.OrderItem.order_id == order_id))
+        ).all()
+        
+        # Check inventory for all items concurrently
+        results = await asyncio.gather(
+            *(check_inventory(item.product_id, item.quantity) for item in order_items)
+        )
+        inventory_available = all(results)
+        
+        if not inventory_available:
+            # Update order status to failed
+            order.status = "failed"
+            order.updated_at = datetime.now()
+            await db.commit()
+            
+            # Notify customer
+            await notify_order_status(order.id, "failed", order.customer_email)
+            logger.warning("Order %s failed due to insufficient inventory", order_id)
+            return
+        
+        # Update inventory for all items concurrently
+        await asyncio.gather(
+            *(update_inventory(item.product_id, item.quantity) for item in order_items)
+        )
+        
+        # Update order status to processed
+        order.status = "processed"
         order.updated_at = datetime.now()
-        db.commit()
+        await db.commit()
         
         # Notify customer
-        await notify_order_status(order.id, "failed", order.customer_email)
-        logger.warning(f"Order {order_id} failed due to insufficient inventory")
-        return
-    
-    # Update inventory for all items
-    for item in order_items:
-        await update_inventory(item.product_id, item.quantity)
-    
-    # Update order status to processed
-    order.status = "processed"
-    order.updated_at = datetime.now()
-    db.commit()
-    
-    # Notify customer
-    await notify_order_status(order.id, "processed", order.customer_email)
-    logger.info(f"Order {order_id} processed successfully")
+        await notify_order_status(order.id, "processed", order.customer_email)
+        logger.info("Order %s processed successfully", order_id)
 
 @app.get("/", tags=["Root"])
 def read_root():
@@ -165,63 +258,73 @@ def read_root():
 async def create_order(
     order: schemas.OrderCreate, 
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Create a new order"""
-    logger.info(f"Creating order for customer: {order.customer_name}")
-    
-    # Create new order
-    db_order = models.Order(
-        customer_name=order.customer_name,
-        customer_email=order.customer_email,
-        status="pending"
-    )
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    logger.info("Creating order for customer: %s", order.customer_name)
     
-    # Add order items
+    # Verify all products exist, fetching them in a single batch
+    products = await get_products_bulk([item.product_id for item in order.items])
     for item in order.items:
-        # Verify product exists
-        product = await get_product_info(item.product_id)
-        if not product:
-            db.delete(db_order)
-            db.commit()
+        if item.product_id not in products:
             raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
-        
-        # Create order item
-        db_item = models.OrderItem(
-            order_id=db_order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            unit_price=product["price"]
-        )
-        db.add(db_item)
     
-    db.commit()
-    
-    # Process order in background
-    background_tasks.add_task(process_order, db_order.id, db)
+    # Insert the order and its items in a single transaction, returning the
+    # stored rows so the response needs no follow-up SELECT
+    db_order = await db.scalar(
+        insert(models.Order)
+        .values(
+            customer_name=order.customer_name,
+            customer_email=order.customer_email,
+            status="pending"
+        )
+        .returning(models.Order)
+    )
+    order_id = db_order.id
+    items_payload = [
+        {
+            "order_id": order_id,
+            "product_id": item.product_id,
+            "quantity": item.quantity,
+            "unit_price": products[item.product_id]["price"]
+        }
+        for item in order.items
+    ]
+    db_items = (
+        await db.scalars(insert(models.OrderItem).returning(models.OrderItem), items_payload)
+    ).all()
+    set_committed_value(db_order, "items", db_items)
+    await db.commit()
     
-    # Refresh order with items
-    db.refresh(db_order)
+    # Queue the order for the order worker, processing it in-process if Redis is unavailable
+    try:
+        await app.state.redis.xadd(
+            ORDER_STREAM, {"order_id": order_id}, maxlen=ORDER_STREAM_MAXLEN, approximate=True
+        )
+    except redis.RedisError as e:
+        logger.error("Failed to queue order %s, processing in background: %s", order_id, e)
+        background_tasks.add_task(process_order, order_id)
     
     return db_order
 
 @app.get("/orders/", response_model=List[schemas.Order], tags=["Orders"])
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_orders(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
     """Get all orders with pagination"""
-    logger.info(f"Fetching orders with skip={skip}, limit={limit}")
-    orders = db.query(models.Order).offset(skip).limit(limit).all()
+    logger.info("Fetching orders with skip=%s, limit=%s", skip, limit)
+    orders = (
+        await db.scalars(
+            select(models.Order).options(selectinload(models.Order.items)).offset(skip).limit(limit)
+        )
+    ).all()
     return orders
 
 @app.get("/orders/{order_id}", response_model=schemas.Order, tags=["Orders"])
-def read_order(order_id: int, db: Session = Depends(get_db)):
+async def read_order(order_id: int, db: AsyncSession = Depends(get_db)):
     """Get order by ID"""
-    logger.info(f"Fetching order with ID: {order_id}")
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    logger.info("Fetching order with ID: %s", order_id)
+    order = await db.get(models.Order, order_id, options=[selectinload(models.Order.items)])
     if order is None:
-        logger.warning(f"Order with ID {order_id} not found")
+        logger.warning("Order with ID %s not found", order_id)
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
@@ -230,20 +333,23 @@ async def update_order_status(
     order_id: int, 
     status_update: schemas.OrderStatusUpdate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Update order status"""
-    logger.info(f"Updating status for order ID: {order_id} to {status_update.status}")
+    logger.info("Updating status for order ID: %s to %s", order_id, status_update.status)
     
-    order = db.query(models.Order).filter(models.Order.id == order_id).first()
+    # Update and fetch the order in one statement; items are eager-loaded for the response
+    order = await db.scalar(
+        update(models.Order)
+        .where(models.Order.id == order_id)
+        .values(status=status_update.status, updated_at=datetime.now())
+        .returning(models.Order)
+        .options(selectinload(models.Order.items))
+    )
     if order is None:
-        logger.warning(f"Order with ID {order_id} not found")
+        logger.warning("Order with ID %s not found", order_id)
         raise HTTPException(status_code=404, detail="Order not found")
-    
-    order.status = status_update.status
-    order.updated_at = datetime.now()
-    db.commit()
-    db.refresh(order)
+    await db.commit()
     
     # Notify customer about status change
     background_tasks.add_task(notify_order_status, order.id, order.status, order.customer_email)
@@ -251,12 +357,17 @@ async def update_order_status(
     return order
 
 @app.get("/orders/customer/{email}", response_model=List[schemas.Order], tags=["Orders"])
-def read_customer_orders(email: str, db: Session = Depends(get_db)):
+async def read_customer_orders(email: str, db: AsyncSession = Depends(get_db)):
     """Get all orders for a customer"""
-    logger.info(f"Fetching orders for customer: {email}")
-    orders = db.query(models.Order).filter(models.Order.customer_email == email).all()
+    logger.info("Fetching orders for customer: %s", email)
+    orders = (
+        await db.scalars(
+            select(models.Order).options(selectinload(models.Order.items)).where(models.Order.customer_email == email)
+        )
+    ).all()
     return orders
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    models.Base.metadata.create_all(bind=database.engine)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools")
@@ -22,7 +22,7 @@ class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     product_id = Column(Integer, nullable=False)
     quantity = Column(Float, nullable=False)
     unit_price = Column(Float, nullable=False)
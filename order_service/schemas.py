@@ -1,6 +1,6 @@
 from typing import List, Optional
 from datetime import datetime
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
 
 class OrderItemBase(BaseModel):
     """Base schema for order items"""
@@ -16,8 +16,7 @@ class OrderItemRead(OrderItemBase):
     id: int
     unit_price: float
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class OrderBase(BaseModel):
     """Base schema for orders"""
@@ -26,19 +25,18 @@ class OrderBase(BaseModel):
 
 class OrderCreate(OrderBase):
     """Schema for creating an order"""
-    items: List[OrderItemCreate] = Field(..., min_items=1)
+    items: List[OrderItemCreate] = Field(..., min_length=1)
 
 class OrderStatusUpdate(BaseModel):
     """Schema for updating order status"""
-    status: str = Field(..., regex="^(pending|processing|processed|failed|delivered)$")
+    status: str = Field(..., pattern="^(pending|processing|processed|failed|delivered)$")
 
 class Order(OrderBase):
     """Schema for reading an order"""
     id: int
     status: str
     created_at: datetime
-    updated_at: Optional[datetime]
+    updated_at: Optional[datetime] = None
     items: List[OrderItemRead]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
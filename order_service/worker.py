@@ -0,0 +1,115 @@
+import os
+import asyncio
+import logging
+import socket
+import redis.asyncio as redis
+
+import main, models, database
+
+logger = logging.getLogger(__name__)
+
+# Consumer group settings; every worker replica needs a distinct consumer name
+CONSUMER_GROUP = os.getenv("ORDER_CONSUMER_GROUP", "order-workers")
+CONSUMER_NAME = os.getenv("ORDER_CONSUMER_NAME", socket.gethostname())
+BATCH_SIZE = int(os.getenv("ORDER_WORKER_BATCH_SIZE", "10"))
+# Entries left unacknowledged this long are claimed and retried
+CLAIM_IDLE_MS = int(os.getenv("ORDER_WORKER_CLAIM_IDLE_MS", "60000"))
+RETRY_SECONDS = float(os.getenv("ORDER_WORKER_RETRY_SECONDS", "5"))
+BLOCK_MS = 5000
+
+async def ensure_consumer_group(client: redis.Redis):
+    """Create the consumer group for the order stream if it does not exist yet"""
+    try:
+        await client.xgroup_create(main.ORDER_STREAM, CONSUMER_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def process_messages(client: redis.Redis, messages: list):
+    """Process order messages, acknowledging only those that were handled"""
+    for message_id, fields in messages:
+        # Entries trimmed from the stream come back without fields
+        if fields is None:
+            await client.xack(main.ORDER_STREAM, CONSUMER_GROUP, message_id)
+            continue
+        try:
+            order_id = int(fields[b"order_id"])
+        except (KeyError, ValueError) as e:
+            logger.error("Dropping malformed order message %s: %s", message_id, e)
+            await client.xack(main.ORDER_STREAM, CONSUMER_GROUP, message_id)
+            continue
+        try:
+            await main.process_order(order_id)
+        except Exception as e:
+            # Leave the entry pending so it is retried
+            logger.error("Failed to process order %s: %s", order_id, e)
+            continue
+        await client.xack(main.ORDER_STREAM, CONSUMER_GROUP, message_id)
+
+async def process_own_pending(client: redis.Redis):
+    """Retry entries this consumer read but never acknowledged, e.g. before a restart"""
+    last_id = "0"
+    while True:
+        entries = await client.xreadgroup(
+            CONSUMER_GROUP, CONSUMER_NAME, {main.ORDER_STREAM: last_id}, count=BATCH_SIZE
+        )
+        messages = entries[0][1] if entries else []
+        if not messages:
+            return
+        await process_messages(client, messages)
+        last_id = messages[-1][0]
+
+async def claim_stale(client: redis.Redis):
+    """Take over entries idle for CLAIM_IDLE_MS, left by dead consumers or failed attempts"""
+    start_id = "0-0"
+    while True:
+        start_id, messages, *_ = await client.xautoclaim(
+            main.ORDER_STREAM, CONSUMER_GROUP, CONSUMER_NAME, CLAIM_IDLE_MS,
+            start_id=start_id, count=BATCH_SIZE
+        )
+        await process_messages(client, messages)
+        if start_id in (b"0-0", "0-0"):
+            return
+
+async def run():
+    """Consume queued orders from the order stream and process them"""
+    # Reuse the service lifespan so the worker gets the same HTTP and Redis clients
+    async with main.lifespan(main.app):
+        # The service client times out after 1s, so blocking stream reads get their own
+        # client with a socket timeout that outlasts the block
+        stream_client = redis.Redis.from_url(
+            main.REDIS_URL, socket_connect_timeout=1, socket_timeout=BLOCK_MS / 1000 + 5
+        )
+        async with stream_client as client:
+            loop = asyncio.get_running_loop()
+            while True:
+                try:
+                    await ensure_consumer_group(client)
+                    await process_own_pending(client)
+                    logger.info("Order worker %s consuming %s", CONSUMER_NAME, main.ORDER_STREAM)
+                    
+                    next_claim = loop.time()
+                    while True:
+                        if loop.time() >= next_claim:
+                            await claim_stale(client)
+                            next_claim = loop.time() + CLAIM_IDLE_MS / 1000
+                    
+                        entries = await client.xreadgroup(
+                            CONSUMER_GROUP, CONSUMER_NAME, {main.ORDER_STREAM: ">"}, count=BATCH_SIZE, block=BLOCK_MS
+                        )
+                        for _, messages in entries:
+                            await process_messages(client, messages)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Order worker failed, retrying in %ss: %s", RETRY_SECONDS, e)
+                    await asyncio.sleep(RETRY_SECONDS)
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=database.engine)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    asyncio.run(run())
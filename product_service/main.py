@@ -1,7 +1,11 @@
 import os
 import logging
+import orjson
+import redis
 from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, update
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -14,11 +18,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Environment variables
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", "300"))
+PRODUCT_LIST_CACHE_TTL = int(os.getenv("PRODUCT_LIST_CACHE_TTL", "30"))
+
+# Bumping the generation orphans every cached product list at once
+PRODUCT_LIST_GENERATION_KEY = "products:list:gen"
+
+# Redis client for the product cache; the order service reads the same product:{id} keys
+cache = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=1, socket_timeout=1)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Product Service",
     description="Manages product information for SmartInventory system",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -41,6 +57,40 @@ def get_db():
     finally:
         db.close()
 
+def cache_get(key: str):
+    """Read a key from the cache, treating Redis errors as a miss"""
+    try:
+        return cache.get(key)
+    except redis.RedisError as e:
+        logger.warning("Error reading %s from cache: %s", key, e)
+        return None
+
+def cache_set(key: str, value: bytes, ttl: int):
+    """Write a key to the cache, ignoring Redis errors"""
+    try:
+        cache.set(key, value, ex=ttl)
+    except redis.RedisError as e:
+        logger.warning("Error caching %s: %s", key, e)
+
+def invalidate_product_cache(product_id: Optional[int] = None):
+    """Drop a cached product and all cached product lists"""
+    try:
+        pipe = cache.pipeline(transaction=False)
+        if product_id is not None:
+            pipe.delete(f"product:{product_id}")
+        pipe.incr(PRODUCT_LIST_GENERATION_KEY)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error("Error invalidating product cache: %s", e)
+
+def serialize_product(product: models.Product) -> bytes:
+    """Serialize a product the same way the API returns it"""
+    return orjson.dumps(schemas.Product.model_validate(product).model_dump())
+
+def serialize_products(products: List[models.Product]) -> bytes:
+    """Serialize a list of products the same way the API returns it"""
+    return orjson.dumps([schemas.Product.model_validate(p).model_dump() for p in products])
+
 @app.get("/", tags=["Root"])
 def read_root():
     """Root endpoint for health checks"""
@@ -49,7 +99,7 @@ def read_root():
 @app.post("/products/", response_model=schemas.Product, status_code=status.HTTP_201_CREATED, tags=["Products"])
 def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
     """Create a new product"""
-    logger.info(f"Creating product: {product.name}")
+    logger.info("Creating product: %s", product.name)
     db_product = models.Product(
         name=product.name,
         description=product.description,
@@ -59,65 +109,113 @@ def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    invalidate_product_cache()
     return db_product
 
 @app.get("/products/", response_model=List[schemas.Product], tags=["Products"])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Get all products with pagination"""
-    logger.info(f"Fetching products with skip={skip}, limit={limit}")
+def read_products(
+    skip: int = 0,
+    limit: int = 100,
+    ids: Optional[str] = Query(None, description="Comma-separated product IDs to fetch in one batch"),
+    db: Session = Depends(get_db)
+):
+    """Get all products with pagination, or a batch of products by ID"""
+    if ids is not None:
+        try:
+            product_ids = [int(product_id) for product_id in ids.split(",") if product_id]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+        logger.info("Fetching products with IDs: %s", product_ids)
+        products = db.query(models.Product).filter(models.Product.id.in_(product_ids)).all()
+        return Response(content=serialize_products(products), media_type="application/json")
+    
+    logger.info("Fetching products with skip=%s, limit=%s", skip, limit)
+    generation = cache_get(PRODUCT_LIST_GENERATION_KEY) or b"0"
+    cache_key = f"products:list:{generation.decode()}:{skip}:{limit}"
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
     products = db.query(models.Product).offset(skip).limit(limit).all()
-    return products
+    content = serialize_products(products)
+    cache_set(cache_key, content, PRODUCT_LIST_CACHE_TTL)
+    return Response(content=content, media_type="application/json")
 
 @app.get("/products/{product_id}", response_model=schemas.Product, tags=["Products"])
 def read_product(product_id: int, db: Session = Depends(get_db)):
     """Get product by ID"""
-    logger.info(f"Fetching product with ID: {product_id}")
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    logger.info("Fetching product with ID: %s", product_id)
+    cache_key = f"product:{product_id}"
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    product = db.get(models.Product, product_id)
     if product is None:
-        logger.warning(f"Product with ID {product_id} not found")
+        logger.warning("Product with ID %s not found", product_id)
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    content = serialize_product(product)
+    cache_set(cache_key, content, PRODUCT_CACHE_TTL)
+    return Response(content=content, media_type="application/json")
+
+@app.head("/products/{product_id}", tags=["Products"])
+def check_product_exists(product_id: int, db: Session = Depends(get_db)):
+    """Check that a product exists without loading or returning it"""
+    exists = db.query(
+        db.query(models.Product.id).filter(models.Product.id == product_id).exists()
+    ).scalar()
+    if not exists:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return Response(status_code=status.HTTP_200_OK)
 
 @app.put("/products/{product_id}", response_model=schemas.Product, tags=["Products"])
 def update_product(product_id: int, product: schemas.ProductUpdate, db: Session = Depends(get_db)):
     """Update a product"""
-    logger.info(f"Updating product with ID: {product_id}")
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+    logger.info("Updating product with ID: %s", product_id)
+    changes = product.model_dump(exclude_unset=True)
+    if changes:
+        # Update and fetch the product in one statement
+        db_product = db.scalar(
+            update(models.Product)
+            .where(models.Product.id == product_id)
+            .values(**changes)
+            .returning(models.Product)
+        )
+    else:
+        db_product = db.get(models.Product, product_id)
     if db_product is None:
-        logger.warning(f"Product with ID {product_id} not found")
+        logger.warning("Product with ID %s not found", product_id)
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Update product attributes
-    for key, value in product.dict(exclude_unset=True).items():
-        setattr(db_product, key, value)
-    
     db.commit()
-    db.refresh(db_product)
+    invalidate_product_cache(product_id)
     return db_product
 
 @app.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT, tags=["Products"])
 def delete_product(product_id: int, db: Session = Depends(get_db)):
     """Delete a product"""
-    logger.info(f"Deleting product with ID: {product_id}")
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if db_product is None:
-        logger.warning(f"Product with ID {product_id} not found")
+    logger.info("Deleting product with ID: %s", product_id)
+    deleted_id = db.scalar(
+        delete(models.Product).where(models.Product.id == product_id).returning(models.Product.id)
+    )
+    if deleted_id is None:
+        logger.warning("Product with ID %s not found", product_id)
         raise HTTPException(status_code=404, detail="Product not found")
     
-    db.delete(db_product)
     db.commit()
+    invalidate_product_cache(product_id)
     return None
 
 @app.get("/products/sku/{sku}", response_model=schemas.Product, tags=["Products"])
 def read_product_by_sku(sku: str, db: Session = Depends(get_db)):
     """Get product by SKU"""
-    logger.info(f"Fetching product with SKU: {sku}")
+    logger.info("Fetching product with SKU: %s", sku)
     product = db.query(models.Product).filter(models.Product.sku == sku).first()
     if product is None:
-        logger.warning(f"Product with SKU {sku} not found")
+        logger.warning("Product with SKU %s not found", sku)
         raise HTTPException(status_code=404, detail="Product not found")
     return product
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools")
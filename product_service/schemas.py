@@ -1,22 +1,27 @@
 from typing import Optional
 from datetime import datetime
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 import re
 
+# Allowed SKU characters, compiled once for all validators
+_SKU_RE = re.compile(r'^[A-Za-z0-9\-]+$')
+
 class ProductBase(BaseModel):
     """Base schema for Product"""
-    name: str = Field(..., min_length=1, max_length=100, example="Laptop")
-    description: Optional[str] = Field(None, max_length=1000, example="A powerful laptop with 16GB RAM")
-    price: float = Field(..., gt=0, example=999.99)
-    sku: str = Field(..., min_length=3, max_length=50, example="LAP-001")
+    name: str = Field(..., min_length=1, max_length=100, examples=["Laptop"])
+    description: Optional[str] = Field(None, max_length=1000, examples=["A powerful laptop with 16GB RAM"])
+    price: float = Field(..., gt=0, examples=[999.99])
+    sku: str = Field(..., min_length=3, max_length=50, examples=["LAP-001"])
 
-    @validator('sku')
+    @field_validator('sku')
+    @classmethod
     def sku_must_be_valid(cls, v):
-        if not re.match(r'^[A-Za-z0-9\-]+$', v):
+        if not _SKU_RE.match(v):
             raise ValueError('SKU must contain only alphanumeric characters and hyphens')
         return v
     
-    @validator('price')
+    @field_validator('price')
+    @classmethod
     def price_must_be_positive(cls, v):
         if v <= 0:
             raise ValueError('Price must be greater than zero')
@@ -33,13 +38,15 @@ class ProductUpdate(BaseModel):
     price: Optional[float] = Field(None, gt=0)
     sku: Optional[str] = Field(None, min_length=3, max_length=50)
 
-    @validator('sku')
+    @field_validator('sku')
+    @classmethod
     def sku_must_be_valid(cls, v):
-        if v and not re.match(r'^[A-Za-z0-9\-]+$', v):
+        if v and not _SKU_RE.match(v):
             raise ValueError('SKU must contain only alphanumeric characters and hyphens')
         return v
     
-    @validator('price')
+    @field_validator('price')
+    @classmethod
     def price_must_be_positive(cls, v):
         if v and v <= 0:
             raise ValueError('Price must be greater than zero')
@@ -48,8 +55,7 @@ class ProductUpdate(BaseModel):
 class Product(ProductBase):
     """Schema for reading a product"""
     id: int
-    created_at: Optional[datetime]
-    updated_at: Optional[datetime]
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)